@@ -8,12 +8,21 @@ Those objects are much faster than WOFFFont, but they require much
 more care.
 """
 
+import os
 import zlib
+import hashlib
+import mmap
+import tempfile
+import threading
+from timeit import default_timer
 import struct
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from cStringIO import StringIO
+from urllib2 import Request, urlopen
 from xml.etree import ElementTree
 from fontTools.ttLib import TTFont, debugmsg, sortedTagList
-from fontTools.ttLib.sfnt import calcChecksum, SFNTDirectoryEntry, \
+from fontTools.ttLib.sfnt import calcChecksum, \
     sfntDirectoryFormat, sfntDirectorySize, sfntDirectoryEntryFormat, sfntDirectoryEntrySize
 
 try:
@@ -36,7 +45,18 @@ class WOFFFont(TTFont):
     This object represents a WOFF file. It is a subclass of
     the FontTools TTFont object, so the same API applies.
     For information about the arguments in __init__,
-    refer to the TTFont documentation.
+    refer to the TTFont documentation. The useMMap,
+    tableCacheSize, readahead, prefetchSize and collectStats
+    arguments are passed to the WOFFReader. See that object for
+    details. The reader statistics are available in the
+    stats attribute.
+
+    If recordDigests is True, the reader stores a digest of
+    every table that it reads. Tables that are read from the
+    file and then saved without being modified can then be
+    copied in their compressed form rather than being
+    compressed again. See the dirtyTracking argument of
+    save for details.
 
     This object has two special attributes: metadata and privateData.
     The metadata attribute returns an ElementTree Element object
@@ -48,7 +68,9 @@ class WOFFFont(TTFont):
 
     def __init__(self, file=None, flavor="\000\001\000\000",
         checkChecksums=0, verbose=False, recalcBBoxes=True,
-        allowVID=False, ignoreDecompileErrors=False):
+        allowVID=False, ignoreDecompileErrors=False, useMMap=False,
+        tableCacheSize=0, readahead=False, prefetchSize=0, collectStats=False,
+        recordDigests=False):
         # can't use the TTFont __init__ because it goes directly to the SFNTReader.
         # see that method for details about all of this.
         self.verbose = verbose
@@ -69,16 +91,22 @@ class WOFFFont(TTFont):
         self._metadata = None
         self._tableOrder = None
         self._tableCache=None
+        self._dirtyTables = set()
 
         if file is not None:
-            if not hasattr(file, "read"):
+            if not hasattr(file, "read") and not hasattr(file, "readRange"):
                 file = open(file, "rb")
-            self.reader = WOFFReader(file, checkChecksums=checkChecksums)
+            self.reader = WOFFReader(file, checkChecksums=checkChecksums,
+                useMMap=useMMap, tableCacheSize=tableCacheSize,
+                readahead=readahead, prefetchSize=prefetchSize,
+                collectStats=collectStats, recordDigests=recordDigests)
             self.flavor = self.reader.flavor
             self.majorVersion = self.reader.majorVersion
             self.minorVersion = self.reader.minorVersion
             self._tableOrder = self.reader.keys()
+            self.stats = self.reader.stats
         else:
+            self.stats = None
             self._metadata = ElementTree.Element("metadata", version="1.0")
             self.privateData = None
 
@@ -129,6 +157,25 @@ class WOFFFont(TTFont):
             tags.remove("GlyphOrder")
         return ["GlyphOrder"] + sortedTagList(tags, self._tableOrder)
 
+    def __setitem__(self, tag, table):
+        TTFont.__setitem__(self, tag, table)
+        self._dirtyTables.add(tag)
+
+    def setTableDirty(self, tag):
+        """
+        Mark a table as modified so that it will be
+        compiled and compressed when the font is saved.
+        Tables set with font[tag] = table are marked
+        automatically.
+        """
+        self._dirtyTables.add(tag)
+
+    def isTableDirty(self, tag):
+        """
+        Return True if the table has been marked as modified.
+        """
+        return tag in self._dirtyTables
+
     def setTableOrder(self, order):
         """
         Set the order in which tables should be written
@@ -137,7 +184,9 @@ class WOFFFont(TTFont):
         """
         self._tableOrder = order
 
-    def save(self, file, compressionLevel=9, recompressTables=False, reorderTables=True, recalculateHeadChecksum=True):
+    def save(self, file, compressionLevel=9, recompressTables=False, reorderTables=True, recalculateHeadChecksum=True, workers=1, streaming=False, spill=False,
+            compressionSearch=False, skipIncompressible=False, compressionCache=None,
+            layoutPolicy="sfnt", dirtyTracking="hash"):
         """
         Save a WOFF into file a file object specifified by the
         file argument.. Optionally, file can be a path and a
@@ -162,6 +211,60 @@ class WOFFFont(TTFont):
         If you are not changing any of the SFNT data, you can set
         recalculateHeadChecksum to False to prevent the recalculation.
         This must be set to False if the font contains a DSIG table.
+
+        If workers is greater than one, the tables will be
+        compressed in parallel by that many threads.
+
+        If streaming is True, the file will be written front
+        to back without seeking, so file can be a pipe, a
+        socket or any other object with a write method.
+
+        If spill is True, compressed table data will be kept
+        in a temporary file rather than in memory until the
+        file is written.
+
+        If compressionSearch is True, a range of zlib settings
+        will be tried for every compressed table and the smallest
+        result will be kept. The savings are recorded in the
+        compressionSavings of the returned WOFFWriterStats.
+        See WOFFWriter for details.
+
+        If skipIncompressible is True, tables that appear to
+        be incompressible will be stored without attempting
+        to compress them. The skipped tables are recorded in
+        the returned WOFFWriterStats. See WOFFWriter for details.
+
+        If compressionCache is given, it is used to avoid
+        compressing tables that are unchanged since an earlier
+        save. See WOFFWriter for details.
+
+        If reorderTables is True, the order of the table data
+        is determined by layoutPolicy. This can be the name of
+        a policy in woffLayoutPolicies or a function that is
+        given a list of tags and returns the tags in the order
+        that they should be written. The default "sfnt" policy
+        follows the OTF/OFF specification. The "critical" policy
+        places the tables needed to identify and set up a font
+        ahead of the other tables so that they can be read
+        from the start of the file. See criticalFirstTableOrder.
+
+        dirtyTracking determines what happens to tables that
+        were read from the file, are loaded and are not marked
+        as modified with setTableDirty. If it is "hash", the
+        table is compiled and, if the compiled data is identical
+        to the data read from the file, the compressed data from
+        the file is used. This requires the font to have been
+        opened with recordDigests set to True. Otherwise, the
+        table is compressed. If it is "explicit", the compressed data
+        from the file is used without compiling the table. Any
+        table changed in place, including tables updated by
+        fontTools when another table is compiled, such as loca,
+        must then be marked with setTableDirty. If it is None,
+        every loaded table is compiled and compressed. This is
+        ignored if recompressTables is True.
+
+        This returns a WOFFWriterStats object describing
+        the work done while saving.
         """
         # if DSIG is to be written, the table order
         # must be completely specified. otherwise the
@@ -178,7 +281,11 @@ class WOFFFont(TTFont):
                 raise WOFFLibError("The 'head' table checkSumAdjustment can not be recalculated when a 'DSIG' table is in the font.")
         # sort the tags if necessary
         if reorderTables:
-            tags = sortedTagList(tags)
+            if not callable(layoutPolicy):
+                if layoutPolicy not in woffLayoutPolicies:
+                    raise WOFFLibError("Unknown layout policy: %r" % layoutPolicy)
+                layoutPolicy = woffLayoutPolicies[layoutPolicy]
+            tags = layoutPolicy(tags)
         # open a file if necessary
         closeStream = False
         if not hasattr(file, "write"):
@@ -191,7 +298,12 @@ class WOFFFont(TTFont):
         writer = WOFFWriter(file, numTables, flavor=self.flavor,
             majorVersion=self.majorVersion, minorVersion=self.minorVersion,
             compressionLevel=compressionLevel, recalculateHeadChecksum=recalculateHeadChecksum,
-            verbose=self.verbose)
+            verbose=self.verbose, workers=workers, streaming=streaming,
+            spill=spill, compressionSearch=compressionSearch,
+            skipIncompressible=skipIncompressible, compressionCache=compressionCache)
+        # unchanged tables are given to the writer as ranges of the
+        # reader's file so that they can be copied by the kernel.
+        canCopyTables = self.reader is not None and self.reader.getFileno() is not None and _getFileno(file) is not None
         for tag in tags:
             origData = None
             origLength = None
@@ -199,11 +311,20 @@ class WOFFFont(TTFont):
             compLength = None
             # table is loaded
             if self.isLoaded(tag):
-                origData = self.getTableData(tag)
+                if recompressTables:
+                    origData = self.getTableData(tag)
+                else:
+                    origData = self._getChangedTableData(tag, dirtyTracking)
+                passThrough = origData is None
+            else:
+                passThrough = self.reader is not None
             # table is in reader
-            elif self.reader is not None:
+            if passThrough:
                 if recompressTables:
                     origData = self.getTableData(tag)
+                elif canCopyTables:
+                    writer.setTableFromSource(tag, *self.reader.getCompressedTableSource(tag))
+                    continue
                 else:
                     if self.verbose:
                         debugmsg("Reading '%s' table from disk" % tag)
@@ -240,6 +361,38 @@ class WOFFFont(TTFont):
         # close the file
         if closeStream:
             file.close()
+        return writer.stats
+
+    def _getChangedTableData(self, tag, dirtyTracking):
+        """
+        Return the compiled data for the loaded table with
+        tag or None if the compressed data from the reader
+        can be written instead.
+        """
+        if dirtyTracking is None or self.reader is None or tag not in self.reader or tag in self._dirtyTables:
+            return self.getTableData(tag)
+        if dirtyTracking == "explicit":
+            return None
+        if dirtyTracking != "hash":
+            raise WOFFLibError("Unknown dirty tracking mode: %r" % dirtyTracking)
+        data = self.getTableData(tag)
+        if self.reader.tableDigests is None:
+            return data
+        digest = self.reader.tableDigests.get(tag)
+        if digest is not None and digest == hashlib.sha1(data).digest():
+            if self.verbose:
+                debugmsg("'%s' table is unchanged" % tag)
+            return None
+        return data
+
+    def saveAsync(self, file, executor=None, loop=None, **kwargs):
+        """
+        Save the font without blocking the asyncio event
+        loop. This returns a future. The keyword arguments
+        are passed to save. See woffTools.aio for details.
+        """
+        from woffTools.aio import saveFontAsync
+        return saveFontAsync(self, file, executor=executor, loop=loop, **kwargs)
 
     def saveXML(self):
         raise NotImplementedError
@@ -247,6 +400,42 @@ class WOFFFont(TTFont):
     def importXML(self):
         raise NotImplementedError
 
+def _saveTestFont(dirtyTags=(), changedTags=(), **kwargs):
+    """
+    Write a small WOFF, open it with recordDigests, read
+    all of its tables, change the data of the tables in
+    changedTags, mark the tables in dirtyTags with
+    setTableDirty and save it with kwargs. This returns
+    the status recorded by the writer for each table.
+
+    >>> _saveTestFont(dirtyTracking="hash")
+    [('aaaa', 'passthrough'), ('bbbb', 'passthrough')]
+    >>> _saveTestFont(dirtyTracking="hash", changedTags=["aaaa"])
+    [('aaaa', 'compressed'), ('bbbb', 'passthrough')]
+    >>> _saveTestFont(dirtyTracking="hash", dirtyTags=["aaaa"])
+    [('aaaa', 'compressed'), ('bbbb', 'passthrough')]
+    >>> _saveTestFont(dirtyTracking="explicit", changedTags=["aaaa"])
+    [('aaaa', 'passthrough'), ('bbbb', 'passthrough')]
+    >>> _saveTestFont(dirtyTracking="explicit", changedTags=["aaaa"], dirtyTags=["aaaa"])
+    [('aaaa', 'compressed'), ('bbbb', 'passthrough')]
+    >>> _saveTestFont(dirtyTracking=None)
+    [('aaaa', 'compressed'), ('bbbb', 'compressed')]
+    """
+    source = StringIO()
+    writer = WOFFWriter(source, 2)
+    writer.setTable("aaaa", "aaaa data " * 50)
+    writer.setTable("bbbb", "bbbb data " * 50)
+    writer.close()
+    font = WOFFFont(source, recordDigests=True)
+    for tag in ("aaaa", "bbbb"):
+        font[tag]
+    for tag in changedTags:
+        font[tag].data = "changed " * 50
+    for tag in dirtyTags:
+        font.setTableDirty(tag)
+    stats = font.save(StringIO(), **kwargs)
+    return sorted([(tag, values["status"]) for tag, values in stats.tables.items()])
+
 
 # ------
 # Reader
@@ -270,28 +459,198 @@ woffHeaderFormat = """
 """
 woffHeaderSize = sstruct.calcsize(woffHeaderFormat)
 
+# precompiled versions of the header and directory entry
+# formats for fast unpacking in the reader.
+woffHeaderStruct = struct.Struct(">4s4sLHHLHHLLLLL")
+woffHeaderFields = ("signature", "flavor", "length", "numTables", "reserved",
+    "totalSFNTSize", "majorVersion", "minorVersion", "metaOffset", "metaLength",
+    "metaOrigLength", "privOffset", "privLength")
+woffDirectoryEntryStruct = struct.Struct(">4sLLLL")
+
+# the number of directory entries read along with the
+# header. this covers the directory of almost all fonts
+# in a single read.
+woffPrefetchDirectoryEntries = 32
+
 class WOFFReader(object):
 
-    def __init__(self, file, checkChecksums=1):
+    """
+    This object reads the raw data from a WOFF file.
+
+    If useMMap is True, the file will be memory mapped
+    and getCompressedTableData, getCompressedMetadata and
+    privateData will return views into the mapped file
+    rather than copies of the data. The data is only
+    copied when it has to be decompressed or is requested
+    in decompressed form. The file must be a real file
+    with a fileno method for this to work.
+
+    If tableCacheSize is greater than zero, decompressed
+    table data will be kept in a WOFFTableDataCache with
+    a budget of tableCacheSize bytes. The cache is available
+    in the tableCache attribute.
+
+    The file may also be a byte source: an object with
+    readRange(offset, length) and close() methods, such as
+    a HTTPRangeSource. The reader only requests the header,
+    the directory and the data that is actually needed
+    from the source. Requests for neighboring tables made
+    through readTables are coalesced into one request.
+    The useMMap argument is ignored for byte sources.
+
+    The reader can be shared between threads. Reads from
+    files are made from the memory map when useMMap is True
+    or with os.pread when it is available, so they do not
+    share a file position. Otherwise, as in Python 2 without
+    useMMap, the seek and read pairs are serialized with a
+    lock. See FileRangeSource.
+
+    If readahead is True, everything following the table
+    directory is read with one sequential read when the
+    reader is created and the data is served from memory.
+    See the readahead method for details.
+
+    If prefetchSize is greater than zero, at least that many
+    bytes from the start of the file are read along with the
+    header and the directory and data within those bytes is
+    served from memory. For a byte source, tables stored at
+    the start of the file, as they are when the file is saved
+    with the "critical" layout policy, can then be read without
+    making any further requests. See woffCriticalPrefetchSize.
+
+    If collectStats is True, a WOFFReaderStats object
+    is available in the stats attribute. Otherwise the
+    stats attribute is None.
+
+    If recordDigests is True, the SHA-1 digest of every
+    decompressed table is stored in the tableDigests
+    dictionary. Otherwise the tableDigests attribute is None.
+    """
+
+    def __init__(self, file, checkChecksums=1, useMMap=False, tableCacheSize=0, readahead=False,
+            prefetchSize=0, collectStats=False, recordDigests=False):
         self.file = file
         self.checkChecksums = checkChecksums
-        # unpack the header
-        self.file.seek(0)
-        bytes = self.file.read(woffHeaderSize)
-        if len(bytes) != woffHeaderSize:
+        self.stats = None
+        if collectStats:
+            self.stats = WOFFReaderStats()
+        self.tableDigests = None
+        if recordDigests:
+            self.tableDigests = {}
+        self.tableCache = None
+        if tableCacheSize > 0:
+            self.tableCache = WOFFTableDataCache(tableCacheSize)
+        self._mmap = None
+        if hasattr(self.file, "readRange"):
+            self._source = self.file
+        else:
+            if useMMap:
+                self._mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._source = FileRangeSource(self.file, fileMap=self._mmap)
+        self._readaheadOffset = 0
+        self._readaheadData = None
+        # read the header and, usually, the whole directory
+        prefetchLength = max(prefetchSize, woffHeaderSize + (woffDirectoryEntrySize * woffPrefetchDirectoryEntries))
+        bytes = str(self._read(0, prefetchLength))
+        if prefetchSize > 0 and self._mmap is None:
+            self._readaheadData = bytes
+        if len(bytes) < woffHeaderSize:
             raise WOFFLibError("Not a properly formatted WOFF file.")
-        sstruct.unpack(woffHeaderFormat, bytes, self)
+        # unpack the header
+        for attr, value in zip(woffHeaderFields, woffHeaderStruct.unpack_from(bytes)):
+            setattr(self, attr, value)
         if self.signature != "wOFF":
             raise WOFFLibError("Not a properly formatted WOFF file.")
+        # read the rest of the directory if necessary
+        directoryEnd = woffHeaderSize + (woffDirectoryEntrySize * self.numTables)
+        if len(bytes) < directoryEnd:
+            bytes += str(self._read(len(bytes), directoryEnd - len(bytes)))
+            if len(bytes) != directoryEnd:
+                raise WOFFLibError("Not a properly formatted WOFF file.")
         # unpack the directory
         self.tables = {}
-        for i in range(self.numTables):
+        for offset in range(woffHeaderSize, directoryEnd, woffDirectoryEntrySize):
             entry = WOFFDirectoryEntry()
-            entry.fromFile(self.file)
+            entry.tag, entry.offset, entry.compLength, entry.origLength, entry.origChecksum = woffDirectoryEntryStruct.unpack_from(bytes, offset)
             self.tables[entry.tag] = entry
+        # read ahead
+        if readahead:
+            self.readahead()
+
+    def readahead(self):
+        """
+        Read the table data, metadata and private data
+        in one sequential read and serve all subsequent
+        reads from memory. WOFF tables are stored one
+        after another, so this avoids a seek and read for
+        every table when all of the tables are needed.
+        This is particularly useful on network file systems.
+        This does nothing if the file is memory mapped.
+        """
+        if self._mmap is not None:
+            return
+        if self._readaheadData is not None and self._readaheadOffset + len(self._readaheadData) >= self.length:
+            return
+        offset = woffHeaderSize + (woffDirectoryEntrySize * self.numTables)
+        data = self._read(offset, max(self.length - offset, 0))
+        self._readaheadOffset = offset
+        self._readaheadData = data
+
+    def _readFromMemory(self, offset, length):
+        """
+        Return a view of the data if it has been read ahead
+        or the file is memory mapped. Otherwise return None.
+        """
+        readaheadData = self._readaheadData
+        if readaheadData is not None:
+            start = offset - self._readaheadOffset
+            if start >= 0 and start + length <= len(readaheadData):
+                return _sliceView(readaheadData, start, length)
+        if self._mmap is not None:
+            return _sliceView(self._mmap, offset, length)
+        return None
+
+    def _read(self, offset, length):
+        """
+        Read length bytes starting at offset. If the file
+        is memory mapped or the data has been read ahead,
+        a view into the data is returned.
+        """
+        data = self._readFromMemory(offset, length)
+        if data is not None:
+            return data
+        data = self._source.readRange(offset, length)
+        if self.stats is not None:
+            self.stats.addRead(len(data))
+        return data
+
+    def _readRanges(self, ranges):
+        """
+        Read a list of (offset, length) ranges. Ranges that
+        are close to each other are read with one request.
+        The data is returned in the order of the ranges.
+        """
+        result = [None] * len(ranges)
+        needed = []
+        for index, (offset, length) in enumerate(ranges):
+            data = self._readFromMemory(offset, length)
+            if data is None:
+                needed.append((offset, length, index))
+            else:
+                result[index] = data
+        for offset, length, members in coalesceRanges(needed, woffRangeCoalesceGap):
+            data = self._read(offset, length)
+            for memberOffset, memberLength, index in members:
+                start = memberOffset - offset
+                result[index] = data[start:start + memberLength]
+        return result
 
     def close(self):
-        self.file.close()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._readaheadData = None
+        self._source.close()
 
     def __contains__(self, tag):
         return tag in self.tables
@@ -311,63 +670,639 @@ class WOFFReader(object):
         return order
 
     def __getitem__(self, tag):
+        data = self._getCachedTable(tag)
+        if data is not None:
+            return data
+        entry = self.tables[tag]
+        return self._decodeTable(tag, self._read(entry.offset, entry.compLength))
+
+    def _getCachedTable(self, tag):
+        if self.tableCache is None:
+            return None
+        data = self.tableCache.get(tag)
+        if self.stats is not None:
+            self.stats.addCacheLookup(data is not None)
+        return data
+
+    def _decodeTable(self, tag, data):
+        """
+        Decompress and verify the compressed data
+        for a table and store it in the cache.
+        """
+        stats = self.stats
         entry = self.tables[tag]
-        self.file.seek(entry.offset)
-        data = self.file.read(entry.compLength)
         # decompress if necessary
         if entry.compLength < entry.origLength:
-            data = zlib.decompress(data)
+            if stats is not None:
+                start = default_timer()
+            try:
+                data = decompressData(data, entry.origLength)
+            except WOFFLibError:
+                raise WOFFLibError("The '%s' table decompresses to more than its origLength." % tag)
+            if stats is not None:
+                stats.addDecompression(tag, len(data), default_timer() - start)
         else:
-            data = data[:entry.origLength]
+            data = str(data[:entry.origLength])
         # compare the checksums
         if self.checkChecksums:
+            if stats is not None:
+                start = default_timer()
             checksum = calcTableChecksum(tag, data)
+            if stats is not None:
+                stats.addChecksum(default_timer() - start)
             if self.checkChecksums > 1:
                 assert checksum == entry.origChecksum, "bad checksum for '%s' table" % tag
             elif checksum != entry.origChecksum:
                 print "bad checksum for '%s' table" % tag
             print
+        if self.tableDigests is not None:
+            self.tableDigests[tag] = hashlib.sha1(data).digest()
+        if self.tableCache is not None:
+            self.tableCache.set(tag, data)
         return data
 
+    def readTables(self, tags=None, workers=1):
+        """
+        Read and decompress the tables listed in tags and
+        return a dictionary of tag : data pairs. If tags
+        is None, all tables will be read. If workers is
+        greater than one, the tables will be decompressed
+        by a pool of that many threads. zlib releases the
+        GIL while it works, so large tables are decompressed
+        in parallel. Checksums are verified as they are in
+        __getitem__.
+        """
+        if tags is None:
+            tags = self.keys()
+        tables = {}
+        needed = []
+        for tag in tags:
+            data = self._getCachedTable(tag)
+            if data is None:
+                needed.append(tag)
+            else:
+                tables[tag] = data
+        # read the compressed data in as few requests as possible
+        ranges = [(self.tables[tag].offset, self.tables[tag].compLength) for tag in needed]
+        compressed = self._readRanges(ranges)
+        workers = min(workers, len(needed))
+        if workers <= 1:
+            for tag, data in zip(needed, compressed):
+                tables[tag] = self._decodeTable(tag, data)
+            return tables
+        # start the largest tables first
+        jobs = sorted(zip(needed, compressed), key=lambda job: -self.tables[job[0]].origLength)
+        pool = ThreadPool(workers)
+        try:
+            data = pool.map(lambda job: self._decodeTable(*job), jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        for (tag, compData), tableData in zip(jobs, data):
+            tables[tag] = tableData
+        return tables
+
     def getCompressedTableData(self, tag):
         entry = self.tables[tag]
-        self.file.seek(entry.offset)
-        data = self.file.read(entry.compLength)
+        data = self._read(entry.offset, entry.compLength)
         return data, entry.origLength, entry.origChecksum, entry.compLength
 
+    def getFileno(self):
+        """
+        Return the file descriptor of the file being
+        read or None if it does not have one.
+        """
+        getFileno = getattr(self._source, "getFileno", None)
+        if getFileno is None:
+            return None
+        return getFileno()
+
+    def getCompressedTableSource(self, tag):
+        """
+        This returns the byte source for the file, the
+        offset of the compressed table data in it and the
+        origLength, origChecksum and compLength values
+        without reading any data. This can be given to
+        WOFFWriter.setTableFromSource.
+        """
+        entry = self.tables[tag]
+        return self._source, entry.offset, entry.origLength, entry.origChecksum, entry.compLength
+
     def getCompressedMetadata(self):
-        self.file.seek(self.metaOffset)
-        data = self.file.read(self.metaLength)
+        data = self._read(self.metaOffset, self.metaLength)
         return data, self.metaOrigLength, self.metaLength
 
     def __getattr__(self, attr):
         if attr not in ("privateData", "metadata"):
             raise AttributeError(attr)
         if attr == "privateData":
-            self.file.seek(self.privOffset)
-            return self.file.read(self.privLength)
+            return self._read(self.privOffset, self.privLength)
         if attr == "metadata":
-            self.file.seek(self.metaOffset)
-            data = self.file.read(self.metaLength)
+            data = self._read(self.metaOffset, self.metaLength)
             if self.metaLength:
-                data = zlib.decompress(data)
-                assert len(data) == self.metaOrigLength
+                if self.stats is not None:
+                    start = default_timer()
+                try:
+                    data = decompressData(data, self.metaOrigLength)
+                except WOFFLibError:
+                    raise WOFFLibError("The metadata decompresses to more than its metaOrigLength.")
+                if self.stats is not None:
+                    self.stats.addDecompression(None, len(data), default_timer() - start)
+            else:
+                data = str(data)
+            if len(data) != self.metaOrigLength:
+                raise WOFFLibError("The metadata does not match its metaOrigLength.")
             return data
 
     def __delitem__(self, tag):
         del self.tables[tag]
+        if self.tableCache is not None:
+            self.tableCache.remove(tag)
+
+
+class WOFFReaderStats(object):
+
+    """
+    Statistics about the work done by a WOFFReader.
+
+    - reads: the number of reads from the file.
+      Memory mapped data is not counted.
+    - bytesRead: the number of bytes read from the file.
+    - bytesDecompressed: the number of bytes produced
+      by decompressing tables and metadata.
+    - decompressTime: a dictionary of tag : seconds
+      spent decompressing each table.
+    - metadataDecompressTime: the seconds spent
+      decompressing the metadata.
+    - checksumTime: the seconds spent verifying
+      table checksums.
+    - cacheHits and cacheMisses: the lookups in
+      the decompressed table cache.
+
+    The asDict method returns all of these values
+    in a dictionary suitable for exporting.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.reads = 0
+            self.bytesRead = 0
+            self.bytesDecompressed = 0
+            self.decompressTime = {}
+            self.metadataDecompressTime = 0
+            self.checksumTime = 0
+            self.cacheHits = 0
+            self.cacheMisses = 0
+
+    def addRead(self, length):
+        with self._lock:
+            self.reads += 1
+            self.bytesRead += length
+
+    def addDecompression(self, tag, length, seconds):
+        with self._lock:
+            self.bytesDecompressed += length
+            if tag is None:
+                self.metadataDecompressTime += seconds
+            else:
+                self.decompressTime[tag] = self.decompressTime.get(tag, 0) + seconds
+
+    def addChecksum(self, seconds):
+        with self._lock:
+            self.checksumTime += seconds
+
+    def addCacheLookup(self, hit):
+        with self._lock:
+            if hit:
+                self.cacheHits += 1
+            else:
+                self.cacheMisses += 1
+
+    def asDict(self):
+        with self._lock:
+            return dict(
+                reads=self.reads,
+                bytesRead=self.bytesRead,
+                bytesDecompressed=self.bytesDecompressed,
+                decompressTime=dict(self.decompressTime),
+                metadataDecompressTime=self.metadataDecompressTime,
+                checksumTime=self.checksumTime,
+                cacheHits=self.cacheHits,
+                cacheMisses=self.cacheMisses
+            )
+
+
+class WOFFTableDataCache(object):
+
+    """
+    A least recently used cache of decompressed table data.
+    The total length of the stored data will not exceed
+    maxSize. Data larger than maxSize is never stored.
+    The number of cache hits and misses are stored in the
+    hits and misses attributes.
+
+    >>> cache = WOFFTableDataCache(10)
+    >>> cache.set("aaaa", "12345")
+    >>> cache.set("bbbb", "12345")
+    >>> cache.get("aaaa")
+    '12345'
+    >>> cache.set("cccc", "12345")
+    >>> cache.get("bbbb") is None
+    True
+    >>> sorted(cache.keys())
+    ['aaaa', 'cccc']
+    >>> cache.hits, cache.misses, cache.size
+    (1, 1, 10)
+    """
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def get(self, tag):
+        with self._lock:
+            data = self._data.pop(tag, None)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # move to the most recently used position
+            self._data[tag] = data
+            return data
+
+    def set(self, tag, data):
+        with self._lock:
+            self._remove(tag)
+            if len(data) > self.maxSize:
+                return
+            while self._data and self.size + len(data) > self.maxSize:
+                oldTag, oldData = self._data.popitem(last=False)
+                self.size -= len(oldData)
+            self._data[tag] = data
+            self.size += len(data)
+
+    def remove(self, tag):
+        with self._lock:
+            self._remove(tag)
+
+    def _remove(self, tag):
+        data = self._data.pop(tag, None)
+        if data is not None:
+            self.size -= len(data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+# ------------
+# Byte Sources
+# ------------
+
+# reads for ranges that are separated by no more than
+# this many bytes are combined into a single read.
+woffRangeCoalesceGap = 1024
+
+class FileRangeSource(object):
+
+    """
+    A byte source for a file object. This is used by
+    WOFFReader when it is given a file. If fileMap, a memory
+    map of the file, is given, reads are slices of the map.
+    The map belongs to the caller and is not closed by this
+    object. Otherwise, reads are made with os.pread when it
+    is available. Neither approach uses the file position,
+    so reads from several threads do not wait for each other.
+    os.pread does not exist in Python 2, so there, unless
+    the file is mapped, the seek and read pairs are
+    serialized with a lock and reads on one file are not
+    made in parallel. The file is not mapped by default
+    because a mapped file that is truncated while it is
+    being read crashes the process rather than raising
+    an error.
+    """
+
+    def __init__(self, file, fileMap=None):
+        self.file = file
+        self._fileno = _getFileno(file)
+        self._lock = threading.Lock()
+        self._map = fileMap
+
+    def getFileno(self):
+        """
+        Return the file descriptor of the file or
+        None if the file does not have one.
+        """
+        return self._fileno
+
+    def readRange(self, offset, length):
+        if self._map is not None:
+            return self._map[offset:offset + length]
+        if self._fileno is not None and hasattr(os, "pread"):
+            return _pread(self._fileno, offset, length)
+        with self._lock:
+            self.file.seek(offset)
+            return self.file.read(length)
+
+    def close(self):
+        self._map = None
+        self.file.close()
+
+
+class HTTPRangeSource(object):
+
+    """
+    A byte source that reads from a URL with HTTP
+    range requests. If the server ignores the range and
+    sends the whole file, the file is kept in memory and
+    all later ranges are sliced from it without making
+    any more requests.
+    """
+
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+        self._data = None
+
+    def readRange(self, offset, length):
+        if length <= 0:
+            return ""
+        data = self._data
+        if data is not None:
+            return data[offset:offset + length]
+        headers = {"Range" : "bytes=%d-%d" % (offset, offset + length - 1)}
+        response = urlopen(Request(self.url, headers=headers), timeout=self.timeout)
+        try:
+            data = response.read()
+            if response.getcode() != 206:
+                self._data = data
+                data = data[offset:offset + length]
+        finally:
+            response.close()
+        return data
+
+    def close(self):
+        self._data = None
+
+
+class LocalRangeSource(object):
+
+    """
+    A byte source that serves ranges from a string in
+    memory and records every request in the requests
+    attribute as an (offset, length) tuple. This stands
+    in for a remote source in tests.
+
+    >>> source = LocalRangeSource("abcdefgh")
+    >>> source.readRange(2, 3)
+    'cde'
+    >>> source.requests, source.bytesServed
+    ([(2, 3)], 3)
+
+    A WOFFReader makes one request for the header and the
+    directory, one for each table read on its own and one
+    for each run of neighboring tables read with readTables.
+
+    >>> f = StringIO()
+    >>> writer = WOFFWriter(f, 3)
+    >>> for tag in ("aaaa", "bbbb", "cccc"):
+    ...     writer.setTable(tag, "".join([chr((i * i) % 251) for i in range(1000)]) + tag)
+    >>> writer.close()
+    >>> source = LocalRangeSource(f.getvalue())
+    >>> reader = WOFFReader(source, checkChecksums=0)
+    >>> source.requests, len(source.data)
+    ([(0, 684)], 956)
+    >>> [(tag, entry.offset, entry.compLength) for tag, entry in sorted(reader.tables.items())]
+    [('aaaa', 104, 282), ('bbbb', 388, 282), ('cccc', 672, 282)]
+    >>> reader["aaaa"][-4:]
+    'aaaa'
+    >>> source.requests[1:]
+    [(104, 282)]
+    >>> sorted(reader.readTables(["bbbb", "cccc"]))
+    ['bbbb', 'cccc']
+    >>> source.requests[2:]
+    [(388, 566)]
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.requests = []
+        self.bytesServed = 0
+
+    def readRange(self, offset, length):
+        self.requests.append((offset, length))
+        data = self.data[offset:offset + length]
+        self.bytesServed += len(data)
+        return data
+
+    def close(self):
+        pass
+
+
+def coalesceRanges(ranges, maxGap=0):
+    """
+    Combine (offset, length, ...) ranges that overlap or
+    are separated by no more than maxGap bytes. This returns
+    a list of (offset, length, members) tuples sorted by
+    offset. members is the list of original ranges that
+    are covered by the combined range.
+
+    >>> coalesceRanges([(10, 5), (0, 4), (30, 2)], maxGap=6)
+    [(0, 15, [(0, 4), (10, 5)]), (30, 2, [(30, 2)])]
+    >>> coalesceRanges([(0, 4), (4, 4), (20, 4)])
+    [(0, 8, [(0, 4), (4, 4)]), (20, 4, [(20, 4)])]
+    """
+    coalesced = []
+    for member in sorted(ranges):
+        offset, length = member[:2]
+        if coalesced:
+            start, end, members = coalesced[-1]
+            if offset - end <= maxGap:
+                coalesced[-1] = (start, max(end, offset + length), members)
+                members.append(member)
+                continue
+        coalesced.append((offset, offset + length, [member]))
+    return [(start, end - start, members) for start, end, members in coalesced]
+
+
+# ----
+# Peek
+# ----
+
+def peek(file):
+    """
+    Read the header and table directory of a WOFF file
+    without creating a WOFFReader or WOFFFont. Only the
+    header and directory bytes are read from the file.
+
+    file may be a path, a file object or a buffer object
+    (bytearray, buffer, memoryview, mmap) containing the
+    WOFF data. A plain string is treated as a path.
+
+    The returned value is a dictionary containing the
+    header values and a "tables" list with a dictionary
+    for each directory entry, in directory order.
+    A WOFFLibError is raised if the data is not a
+    properly formatted WOFF file.
+    """
+    if hasattr(file, "read"):
+        header, directory = _peekFile(file)
+    elif isinstance(file, basestring):
+        f = open(file, "rb")
+        try:
+            header, directory = _peekFile(f)
+        finally:
+            f.close()
+    else:
+        header = _sliceBytes(file, 0, woffHeaderSize)
+        header, numTables = _peekUnpackHeader(header)
+        directory = _sliceBytes(file, woffHeaderSize, woffDirectoryEntrySize * numTables)
+    tables = []
+    for position in range(0, len(directory) - woffDirectoryEntrySize + 1, woffDirectoryEntrySize):
+        tag, offset, compLength, origLength, origChecksum = woffDirectoryEntryStruct.unpack_from(directory, position)
+        tables.append(dict(tag=tag, offset=offset, compLength=compLength, origLength=origLength, origChecksum=origChecksum))
+    if len(tables) != header["numTables"]:
+        raise WOFFLibError("Not a properly formatted WOFF file.")
+    header["tables"] = tables
+    return header
+
+def _peekFile(file):
+    file.seek(0)
+    header, numTables = _peekUnpackHeader(file.read(woffHeaderSize))
+    directory = file.read(woffDirectoryEntrySize * numTables)
+    return header, directory
+
+def _peekUnpackHeader(data):
+    if len(data) != woffHeaderSize:
+        raise WOFFLibError("Not a properly formatted WOFF file.")
+    header = dict(zip(woffHeaderFields, woffHeaderStruct.unpack(data)))
+    if header["signature"] != "wOFF":
+        raise WOFFLibError("Not a properly formatted WOFF file.")
+    return header, header["numTables"]
 
 
 # ------
 # Writer
 # ------
 
+# the tables placed first by criticalFirstTableOrder. these
+# are the tables needed to identify a font and set up a
+# renderer. post is included because the glyph order of
+# TrueType fonts, which is needed to decompile the cmap,
+# comes from it.
+woffCriticalTables = ["head", "hhea", "maxp", "OS/2", "cmap", "name", "post"]
+# the outline tables placed last by criticalFirstTableOrder.
+woffOutlineTables = ["glyf", "CFF ", "CFF2"]
+# a prefetchSize for WOFFReader that usually covers the
+# critical tables of a font saved with the "critical" policy.
+woffCriticalPrefetchSize = 16384
+
+def sfntTableOrder(tags):
+    """
+    Order tags following the suggested ordering in
+    the OTF/OFF specification.
+    """
+    return sortedTagList(tags)
+
+def criticalFirstTableOrder(tags):
+    """
+    Order tags so that the tables in woffCriticalTables
+    come first, in that order, and the tables in
+    woffOutlineTables come last. The other tables
+    are ordered following the OTF/OFF specification.
+
+    >>> criticalFirstTableOrder(["glyf", "loca", "name", "head", "kern", "cmap"])
+    ['head', 'cmap', 'name', 'loca', 'kern', 'glyf']
+    """
+    critical = [tag for tag in woffCriticalTables if tag in tags]
+    outlines = [tag for tag in woffOutlineTables if tag in tags]
+    others = [tag for tag in tags if tag not in critical and tag not in outlines]
+    return critical + sortedTagList(others) + outlines
+
+# the layout policies available to WOFFFont.save by name
+woffLayoutPolicies = {
+    "sfnt" : sfntTableOrder,
+    "critical" : criticalFirstTableOrder,
+}
+
 class WOFFWriter(object):
 
+    """
+    This object writes a WOFF file.
+
+    If workers is greater than one, the tables given to
+    setTable are compressed by a pool of that many threads.
+    zlib releases the GIL while it works, so the tables are
+    compressed in parallel. The output is identical to the
+    output written with a single worker.
+
+    If streaming is True, the file is written strictly
+    front to back in close without any seeking, so file
+    can be a pipe, a socket or any object with a write
+    method. The output starts at the current position.
+    Otherwise, the output is written from the beginning
+    of the file.
+
+    If spill is True, the compressed data for each table is
+    written to a temporary spill file as soon as it is ready
+    rather than being held in memory until close. close
+    copies the data from the spill file in chunks, so the
+    peak memory use is bounded by the largest single table.
+    If workers is also greater than one, setTable waits
+    until a worker is free before accepting another table,
+    so no more than workers tables are held at once and the
+    peak memory use is bounded by workers times the largest
+    table.
+
+    If compressionSearch is True, every table is compressed
+    with each combination of the levels, memLevels and
+    strategies in woffCompressionSearchParameters, on a pool
+    of threads, and the smallest stream is kept. This is much
+    slower than normal compression. The results are stored in
+    the compressionSavings attribute and in the stats as a
+    dictionary of tag : dict(defaultLength, compLength, level,
+    memLevel, strategy) where defaultLength is the length
+    produced with the compressionLevel and the zlib defaults.
+
+    If skipIncompressible is True, tables that
+    isLikelyIncompressible reports as not worth compressing
+    are stored uncompressed without being compressed first.
+    The number of bytes and the tags of the tables stored
+    this way are kept in the skippedCompressionBytes and
+    skippedCompressionTags attributes and in the stats.
+
+    If compressionCache is given, compressed table data is
+    looked up in and stored in it so that tables that have
+    not changed since an earlier save are not compressed
+    again. compressionCache can be a WOFFCompressionCache
+    or the path to a directory, in which case a
+    WOFFCompressionCache with the default maximum size is
+    used. Tables found in the cache are not recorded in
+    compressionSavings or skippedCompressionBytes.
+
+    The work done by the writer is recorded in a
+    WOFFWriterStats object in the stats attribute.
+    """
+
     def __init__(self, file, numTables, flavor="\000\001\000\000",
             majorVersion=0, minorVersion=0, compressionLevel=9,
             recalculateHeadChecksum=True,
-            verbose=False):
+            verbose=False, workers=1, streaming=False, spill=False,
+            compressionSearch=False, skipIncompressible=False,
+            compressionCache=None):
         self.signature = "wOFF"
         self.flavor = flavor
         self.length = woffHeaderSize + (numTables * woffDirectoryEntrySize)
@@ -382,10 +1317,14 @@ class WOFFWriter(object):
         self.privLength = 0
         self.reserved = 0
 
+        self.stats = WOFFWriterStats()
+        self._startTime = default_timer()
+
         self.file = file
         self.compressionLevel = compressionLevel
         self.recalculateHeadChecksum = recalculateHeadChecksum
         self.verbose = verbose
+        self.streaming = streaming
 
         # the data is held to facilitate the
         # head checkSumAdjustment calculation.
@@ -395,6 +1334,54 @@ class WOFFWriter(object):
         self.tableDataEnd = 0
         self.metadataEnd = 0
 
+        # compression parameter search
+        self.compressionSearch = compressionSearch
+        self._searchPool = None
+        self._searchPoolLock = threading.Lock()
+
+        # incompressible data detection
+        self.skipIncompressible = skipIncompressible
+
+        # compressed table data stored between saves
+        if isinstance(compressionCache, basestring):
+            compressionCache = WOFFCompressionCache(compressionCache)
+        self.compressionCache = compressionCache
+
+        # tables that do not need a conformance check
+        self._verifiedTables = set()
+
+        # compressed table data written to disk
+        self._spillFile = None
+        self._spillLock = threading.Lock()
+        if spill:
+            self._spillFile = tempfile.TemporaryFile()
+
+        # tables being compressed by the worker threads
+        self._pendingTables = {}
+        self._pool = None
+        self._spillSlots = None
+        if workers > 1:
+            self._pool = ThreadPool(workers)
+            # limit the raw table data waiting for
+            # the workers when memory is being saved.
+            if spill:
+                self._spillSlots = threading.BoundedSemaphore(workers)
+
+    # the counters are kept in the stats so that
+    # they are available to WOFFFont.save callers.
+
+    @property
+    def compressionSavings(self):
+        return self.stats.compressionSavings
+
+    @property
+    def skippedCompressionBytes(self):
+        return self.stats.skippedCompressionBytes
+
+    @property
+    def skippedCompressionTags(self):
+        return self.stats.skippedCompressionTags
+
     def _tableOrder(self):
         return [entry.tag for index, entry, data in sorted(self.tables.values())]
 
@@ -404,23 +1391,145 @@ class WOFFWriter(object):
         if self.recalculateHeadChecksum and tag == "head":
             # decompress
             if compLength is not None and compLength < origLength:
-                data = zlib.decompress(data)
+                data = decompressData(data, origLength)
             entry = self._prepTable(tag, data, origLength=len(data), entryOnly=True)
+        # compress in a worker thread. a placeholder holds
+        # the position of the table until the result is collected.
+        elif self._pool is not None and compLength is None:
+            if self._spillSlots is None:
+                self._pendingTables[tag] = self._pool.apply_async(self._prepAndSpillTable, (tag, data))
+            else:
+                self._spillSlots.acquire()
+                self._pendingTables[tag] = self._pool.apply_async(self._prepAndSpillPooledTable, (tag, data))
+            self._verifiedTables.add(tag)
+            self.tables[tag] = (len(self.tables), None, None)
+            return
         # compress
         else:
-            entry, data = self._prepTable(tag, data=data, origLength=origLength, origChecksum=origChecksum, compLength=compLength)
+            entry, data = self._prepAndSpillTable(tag, data=data, origLength=origLength, origChecksum=origChecksum, compLength=compLength)
         # store
+        self._pendingTables.pop(tag, None)
+        # data compressed by this object is known to match its
+        # directory entry. data and entry values given by the
+        # caller must be checked in close.
+        if compLength is None:
+            self._verifiedTables.add(tag)
+        else:
+            self._verifiedTables.discard(tag)
         self.tables[tag] = (len(self.tables), entry, data)
 
+    def setTableFromSource(self, tag, source, offset, origLength, origChecksum, compLength):
+        """
+        Add a table whose compressed data is compLength bytes
+        at offset in a byte source, such as the one returned
+        by WOFFReader.getCompressedTableSource. The data is not
+        read until close. There, the conformance of each table
+        is checked, as it is for other data given with
+        origLength, origChecksum and compLength, and the data
+        is released before the next table is read. The data is
+        read again when it is written, unless the writer is
+        spilling, in which case it is written to the spill file
+        after it is checked. When the platform can copy between
+        files in the kernel with os.copy_file_range or
+        os.sendfile, the second read is made by the kernel.
+        Python 2 has neither function.
+        """
+        if self.recalculateHeadChecksum and tag == "head":
+            data = source.readRange(offset, compLength)
+            self.setTable(tag, data, origLength=origLength, origChecksum=origChecksum, compLength=compLength)
+            return
+        entry = WOFFDirectoryEntry()
+        entry.tag = tag
+        entry.offset = 0
+        entry.origLength = origLength
+        entry.origChecksum = origChecksum
+        entry.compLength = compLength
+        if entry.origLength < entry.compLength:
+            raise WOFFLibError("origLength and compLength are not correct in the '%s' table entry." % tag)
+        self._pendingTables.pop(tag, None)
+        self._verifiedTables.discard(tag)
+        self.stats.addTable(tag, origLength, compLength, "passthrough")
+        self.tables[tag] = (len(self.tables), entry, _SourceTableData(source, offset, compLength))
+
+    def _readSourceTableData(self, data):
+        result = data.source.readRange(data.offset, data.length)
+        if len(result) != data.length:
+            raise WOFFLibError("The source data is truncated.")
+        return result
+
+    def _collectPendingTables(self):
+        """
+        Wait for the worker threads and store the
+        compressed tables in their original positions.
+        """
+        if self._pool is None:
+            return
+        try:
+            for tag, result in sorted(self._pendingTables.items()):
+                index = self.tables[tag][0]
+                entry, data = result.get()
+                self.tables[tag] = (index, entry, data)
+        finally:
+            self._pendingTables = {}
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    # spill support
+
+    def _prepAndSpillTable(self, tag, data, **kwargs):
+        entry, data = self._prepTable(tag, data, **kwargs)
+        return entry, self._spillTableData(data)
+
+    def _prepAndSpillPooledTable(self, tag, data):
+        try:
+            return self._prepAndSpillTable(tag, data)
+        finally:
+            self._spillSlots.release()
+
+    def _spillTableData(self, data):
+        """
+        Write data to the spill file and return a
+        _SpilledTableData that refers to it. If the
+        writer is not spilling, data is returned.
+        """
+        if self._spillFile is None:
+            return data
+        with self._spillLock:
+            self._spillFile.seek(0, 2)
+            offset = self._spillFile.tell()
+            self._spillFile.write(data)
+        return _SpilledTableData(offset, len(data))
+
+    def _loadTableData(self, data):
+        if not isinstance(data, _SpilledTableData):
+            return data
+        with self._spillLock:
+            self._spillFile.seek(data.offset)
+            return self._spillFile.read(data.length)
+
+    def _copySpilledTableData(self, data, chunkSize=1048576):
+        with self._spillLock:
+            self._spillFile.seek(data.offset)
+            remaining = data.length
+            while remaining:
+                chunk = self._spillFile.read(min(chunkSize, remaining))
+                if not chunk:
+                    raise WOFFLibError("The spill file is truncated.")
+                self.file.write(chunk)
+                remaining -= len(chunk)
+
     def setMetadata(self, data, metaOrigLength=None, metaLength=None):
         if not data:
             return
         if metaLength is None:
             if self.verbose:
                 debugmsg("compressing metadata")
+            start = default_timer()
             metaOrigLength = len(data)
             data = zlib.compress(data, self.compressionLevel)
             metaLength = len(data)
+            self.stats.metadataCompressTime = default_timer() - start
         # set the header values
         self.metaOrigLength = metaOrigLength
         self.metaLength = metaLength
@@ -437,44 +1546,89 @@ class WOFFWriter(object):
         self.privateData = data
 
     def close(self):
+        self._collectPendingTables()
         if self.numTables != len(self.tables):
             raise WOFFLibError("wrong number of tables; expected %d, found %d" % (self.numTables, len(self.tables)))
         # first, handle the checkSumAdjustment
         if self.recalculateHeadChecksum and "head" in self.tables:
             self._handleHeadChecksum()
         # check the table directory conformance
+        start = default_timer()
         for tag, (index, entry, data) in sorted(self.tables.items()):
-            self._checkTableConformance(entry, data)
-        # write the header
-        header = sstruct.pack(woffHeaderFormat, self)
-        self.file.seek(0)
-        self.file.write(header)
-        # update the directory offsets
+            if tag in self._verifiedTables:
+                continue
+            # source data is checked one table at a time so that
+            # no more than one table is held in memory.
+            if isinstance(data, _SourceTableData):
+                sourceData = self._readSourceTableData(data)
+                self._checkTableConformance(entry, sourceData)
+                if self._spillFile is not None:
+                    self.tables[tag] = (index, entry, self._spillTableData(sourceData))
+                del sourceData
+                continue
+            self._checkTableConformance(entry, self._loadTableData(data))
+        self.stats.conformanceTime = default_timer() - start
+        # calculate the offsets and lengths
+        self._calcLayout()
+        # gather everything, front to back
+        buffers = []
+        self._packHeader(buffers)
+        self._packTableDirectory(buffers)
+        self._packTableData(buffers)
+        self._packMetadata(buffers)
+        self._packPrivateData(buffers)
+        # write
+        if not self.streaming:
+            self.file.seek(0)
+        self._writeBuffers(buffers)
+        if self._spillFile is not None:
+            self._spillFile.close()
+            self._spillFile = None
+        if self._searchPool is not None:
+            self._searchPool.close()
+            self._searchPool = None
+        # go to the beginning of the file
+        if not self.streaming:
+            self.file.seek(0)
+        self.stats.totalTime = default_timer() - self._startTime
+
+    # layout
+
+    def _calcLayout(self):
+        """
+        Calculate the offset of every table, the metadata
+        and the private data and the header values that
+        depend on them. This must be done before anything
+        is written so that the file can be written in one pass.
+        """
+        # the table data
         offset = woffHeaderSize + (woffDirectoryEntrySize * self.numTables)
-        order = self._tableOrder()
-        for tag in order:
+        for tag in self._tableOrder():
             index, entry, data = self.tables[tag]
             entry.offset = offset
             offset += calc4BytePaddedLength(entry.compLength) # ensure byte alignment
-        # write the directory
-        self._writeTableDirectory()
-        # write the table data
-        self._writeTableData()
-        # write the metadata
-        self._writeMetadata()
-        # write the private data
-        self._writePrivateData()
-        # write the header
-        self._writeHeader()
-        # go to the beginning of the file
-        self.file.seek(0)
+            self.totalSFNTSize += calc4BytePaddedLength(entry.origLength) # ensure byte alignment
+        self.tableDataEnd = self.length = offset
+        # the metadata
+        if self.metadata is not None:
+            self.metaOffset = self.tableDataEnd
+            self.metadataEnd = self.metaOffset + self.metaLength
+            # if private data exists, pad to a four byte boundary
+            if self.privateData is not None:
+                self.metadataEnd = calc4BytePaddedLength(self.metadataEnd)
+            self.length = self.metadataEnd
+        # the private data
+        if self.privateData is not None:
+            if self.metadata is not None:
+                self.privOffset = self.metadataEnd
+            else:
+                self.privOffset = self.tableDataEnd
+            self.length = self.privOffset + self.privLength
 
     # header support
 
-    def _writeHeader(self):
-        header = sstruct.pack(woffHeaderFormat, self)
-        self.file.seek(0)
-        self.file.write(header)
+    def _packHeader(self, buffers):
+        buffers.append(sstruct.pack(woffHeaderFormat, self))
 
     # sfnt support
 
@@ -488,18 +1642,28 @@ class WOFFWriter(object):
         else:
             # compress
             if compLength is None:
+                start = default_timer()
                 origData = data
                 origLength = len(origData)
-                origChecksum = calcTableChecksum(tag, data)
-                if self.verbose:
-                    debugmsg("compressing '%s' table" % tag)
-                compData = zlib.compress(origData, self.compressionLevel)
-                compLength = len(compData)
-                if origLength <= compLength:
-                    data = origData
-                    compLength = origLength
+                cached = None
+                if self.compressionCache is not None:
+                    cacheKey = self.compressionCache.makeKey(tag, origData, self._compressionParameters())
+                    cached = self.compressionCache.get(cacheKey)
+                if cached is not None:
+                    if self.verbose:
+                        debugmsg("using cached '%s' table" % tag)
+                    origChecksum, data = cached
+                    compLength = len(data)
                 else:
-                    data = compData
+                    origChecksum = calcTableChecksum(tag, data)
+                    data, compLength = self._compressTableData(tag, origData)
+                    if self.compressionCache is not None:
+                        self.compressionCache.set(cacheKey, origChecksum, data)
+                status = "raw" if compLength == origLength else "compressed"
+                self.stats.addTable(tag, origLength, compLength, status,
+                    default_timer() - start, cached=cached is not None)
+            else:
+                self.stats.addTable(tag, origLength, compLength, "passthrough")
         # make the directory entry
         entry = WOFFDirectoryEntry()
         entry.tag = tag
@@ -512,11 +1676,67 @@ class WOFFWriter(object):
             return entry
         return entry, data
 
+    def _compressionParameters(self):
+        """
+        The settings that change the output of _compressTableData.
+        """
+        return (self.compressionLevel, self.compressionSearch, self.skipIncompressible)
+
+    def _compressTableData(self, tag, data):
+        """
+        Compress the data for a table. If compressing does
+        not make the data smaller, the data is returned as is.
+        This returns the data and the compressed length.
+        """
+        if self.skipIncompressible and isLikelyIncompressible(data):
+            if self.verbose:
+                debugmsg("storing '%s' table uncompressed" % tag)
+            self.stats.addSkippedCompression(tag, len(data))
+            return data, len(data)
+        if self.verbose:
+            debugmsg("compressing '%s' table" % tag)
+        if self.compressionSearch:
+            compData = self._searchCompression(tag, data)
+        else:
+            compData = zlib.compress(data, self.compressionLevel)
+        if len(data) <= len(compData):
+            return data, len(data)
+        return compData, len(compData)
+
+    def _searchCompression(self, tag, data):
+        """
+        Compress data with every set of parameters in
+        woffCompressionSearchParameters and return the
+        smallest result that decompresses to data.
+        """
+        with self._searchPoolLock:
+            if self._searchPool is None:
+                self._searchPool = ThreadPool(woffCompressionSearchWorkers)
+        default = (self.compressionLevel, 8, zlib.Z_DEFAULT_STRATEGY)
+        trials = [default] + [parameters for parameters in woffCompressionSearchParameters if parameters != default]
+        results = self._searchPool.map(lambda parameters: _compressWithParameters(data, *parameters), trials)
+        defaultLength = len(results[0])
+        # the first of the smallest results wins so that the output is stable
+        for compData, parameters in sorted(zip(results, trials), key=lambda result: len(result[0])):
+            try:
+                if decompressData(compData, len(data)) == data:
+                    break
+            except (WOFFLibError, zlib.error):
+                pass
+        else:
+            compData, parameters = results[0], default
+        level, memLevel, strategy = parameters
+        self.stats.addCompressionSavings(tag, defaultLength, len(compData), level, memLevel, strategy)
+        if self.verbose:
+            debugmsg("saved %d bytes in '%s' table" % (defaultLength - len(compData), tag))
+        return compData
+
     def _checkTableConformance(self, entry, data):
         """
         Check the conformance of the table directory entries.
         These must be checked because the origChecksum, origLength
-        and compLength can be set by an outside caller.
+        and compLength can be set by an outside caller. Tables
+        compressed by this object are not checked.
         """
         if self.verbose:
             debugmsg("checking conformance of '%s' table" % entry.tag)
@@ -525,7 +1745,10 @@ class WOFFWriter(object):
             raise WOFFLibError("origLength and compLength are not correct in the '%s' table entry." % entry.tag)
         # unpack the data as needed
         if entry.origLength > entry.compLength:
-            origData = zlib.decompress(data)
+            try:
+                origData = decompressData(data, entry.origLength)
+            except WOFFLibError:
+                raise WOFFLibError("origLength is not correct in the '%s' table entry." % entry.tag)
             compData = data
         else:
             origData = data
@@ -553,74 +1776,507 @@ class WOFFWriter(object):
         # set the value in the head table
         index, entry, data = self.tables["head"]
         data = data[:8] + struct.pack(">L", checkSumAdjustment) + data[12:]
-        # compress the data
-        newEntry, data = self._prepTable("head", data)
-        # update the entry data
-        assert entry.origChecksum == newEntry.origChecksum
-        entry.origLength = newEntry.origLength
-        entry.compLength = newEntry.compLength
+        # compress the data. the checksum was calculated from this
+        # data in setTable and checkSumAdjustment is not part of it,
+        # so there is nothing to recalculate or verify.
+        start = default_timer()
+        data, entry.compLength = self._compressTableData("head", data)
+        status = "raw" if entry.compLength == entry.origLength else "compressed"
+        self.stats.addTable("head", entry.origLength, entry.compLength, status, default_timer() - start)
+        self._verifiedTables.add("head")
         # store
         self.tables["head"] = (index, entry, data)
 
-    def _writeTableDirectory(self):
+    def _packTableDirectory(self, buffers):
         if self.verbose:
             debugmsg("writing table directory")
-        self.file.seek(woffHeaderSize)
-        for tag, (index, entry, data) in sorted(self.tables.items()):
-            entry = sstruct.pack(woffDirectoryEntryFormat, entry)
-            self.file.write(entry)
+        buffers.append("".join([entry.toString() for tag, (index, entry, data) in sorted(self.tables.items())]))
 
-    def _writeTableData(self):
-        d = woffHeaderSize + (woffDirectoryEntrySize * self.numTables)
-        offset = woffHeaderSize + (woffDirectoryEntrySize * self.numTables)
-        self.file.seek(offset)
+    def _packTableData(self, buffers):
         for tag in self._tableOrder():
             if self.verbose:
                 debugmsg("writing '%s' table" % tag)
             index, entry, data = self.tables[tag]
-            data += "\0" * (calc4BytePaddedLength(entry.compLength) - entry.compLength ) # ensure byte alignment
-            self.file.write(data)
-            self.length += calc4BytePaddedLength(entry.compLength) # ensure byte alignment
-            self.totalSFNTSize += calc4BytePaddedLength(entry.origLength) # ensure byte alignment
-        # store the end for use by metadata or private data
-        self.tableDataEnd = self.length
+            buffers.append(data)
+            buffers.append(_paddingBytes[calc4BytePaddedLength(entry.compLength) - entry.compLength]) # ensure byte alignment
 
     # metadata support
 
-    def _writeMetadata(self):
+    def _packMetadata(self, buffers):
         if self.metadata is None:
             return
         if self.verbose:
             debugmsg("writing metadata")
-        self.length += self.metaLength
-        self.metaOffset = self.tableDataEnd
-        self.file.seek(self.metaOffset)
-        self.file.write(self.metadata)
-        # store the end for use by private data
-        self.metadataEnd = self.metaOffset + self.metaLength
+        buffers.append(self.metadata)
         # if private data exists, pad to a four byte boundary
-        if self.privateData is not None:
-            padding = calc4BytePaddedLength(self.metaLength) - self.metaLength
-            self.metadataEnd += padding
-            self.length += padding
-            padding = "\0" * padding
-            if padding:
-                self.file.write(padding)
+        buffers.append(_paddingBytes[self.metadataEnd - self.metaOffset - self.metaLength])
 
     # private data support
 
-    def _writePrivateData(self):
+    def _packPrivateData(self, buffers):
         if self.privateData is None:
             return
         if self.verbose:
             debugmsg("writing private data")
-        if self.metadata is not None:
-            self.privOffset = self.metadataEnd
-        else:
-            self.privOffset = self.tableDataEnd
-        self.length += self.privLength
-        self.file.seek(self.privOffset)
-        self.file.write(self.privateData)
+        buffers.append(self.privateData)
+
+    # output
+
+    def _writeBuffers(self, buffers):
+        """
+        Write the buffers in as few system calls as possible.
+        Runs of data are written with os.writev when the file
+        supports it. os.writev does not exist in Python 2, so
+        there the runs are handed to the file's writelines
+        method. Views of the reader's data are copied to
+        strings first because some file objects, such as
+        cStringIO, only accept strings. Spilled table data
+        is copied from the spill file in chunks.
+        """
+        fileno = _getFileno(self.file)
+        run = []
+        for data in buffers + [None]:
+            if data is not None and not isinstance(data, (_SpilledTableData, _SourceTableData)):
+                if len(data):
+                    run.append(data)
+                continue
+            if run:
+                if fileno is not None and hasattr(os, "writev"):
+                    self.file.flush()
+                    _writev(fileno, run)
+                elif hasattr(self.file, "writelines"):
+                    self.file.writelines([chunk if isinstance(chunk, str) else _sliceBytes(chunk, 0, len(chunk)) for chunk in run])
+                else:
+                    for chunk in run:
+                        self.file.write(chunk)
+                run = []
+            if isinstance(data, _SpilledTableData):
+                self._copySpilledTableData(data)
+            elif isinstance(data, _SourceTableData):
+                self._copySourceTableData(data, fileno)
+
+    def _copySourceTableData(self, data, fileno, chunkSize=1048576):
+        copied = 0
+        getFileno = getattr(data.source, "getFileno", None)
+        if fileno is not None and getFileno is not None and getFileno() is not None:
+            self.file.flush()
+            copied = _copyFileRange(getFileno(), data.offset, data.length, fileno)
+        while copied < data.length:
+            chunk = data.source.readRange(data.offset + copied, min(chunkSize, data.length - copied))
+            if not chunk:
+                raise WOFFLibError("The source data is truncated.")
+            self.file.write(chunk)
+            copied += len(chunk)
+
+class WOFFWriterStats(object):
+
+    """
+    Statistics about the work done by a WOFFWriter.
+
+    - tables: a dictionary of tag : dict(origLength,
+      compLength, compressTime, status, cached) for every
+      table. status is "compressed" if the table was
+      compressed by the writer, "raw" if the writer stored
+      it uncompressed and "passthrough" if the table was
+      given to the writer already compressed. cached is
+      True if the data was found in the compressionCache.
+    - conformanceTime: the seconds spent checking the
+      tables that were not compressed by the writer.
+    - metadataCompressTime: the seconds spent
+      compressing the metadata.
+    - totalTime: the seconds from the creation of the
+      writer until the end of close.
+    - compressionSavings: a dictionary of tag :
+      dict(defaultLength, compLength, level, memLevel,
+      strategy) for every table compressed in the
+      compressionSearch mode of WOFFWriter.
+    - skippedCompressionBytes and skippedCompressionTags:
+      the number of bytes and the tags of the tables that
+      were stored uncompressed without being compressed
+      in the skipIncompressible mode of WOFFWriter.
+
+    The compressionSavings, skippedCompressionBytes and
+    skippedCompressionTags attributes of the writer are
+    read from this object. This is the object returned
+    by WOFFFont.save. The asDict method returns all of
+    these values in a dictionary suitable for exporting.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.tables = {}
+            self.conformanceTime = 0
+            self.metadataCompressTime = 0
+            self.totalTime = 0
+            self.compressionSavings = {}
+            self.skippedCompressionBytes = 0
+            self.skippedCompressionTags = []
+
+    def addTable(self, tag, origLength, compLength, status, compressTime=0, cached=False):
+        with self._lock:
+            self.tables[tag] = dict(origLength=origLength, compLength=compLength,
+                compressTime=compressTime, status=status, cached=cached)
+
+    def addCompressionSavings(self, tag, defaultLength, compLength, level, memLevel, strategy):
+        with self._lock:
+            self.compressionSavings[tag] = dict(defaultLength=defaultLength, compLength=compLength,
+                level=level, memLevel=memLevel, strategy=strategy)
+
+    def addSkippedCompression(self, tag, length):
+        with self._lock:
+            self.skippedCompressionBytes += length
+            self.skippedCompressionTags.append(tag)
+
+    def asDict(self):
+        with self._lock:
+            return dict(
+                skippedCompressionBytes=self.skippedCompressionBytes,
+                skippedCompressionTags=list(self.skippedCompressionTags),
+                tables=dict((tag, dict(values)) for tag, values in self.tables.items()),
+                compressionSavings=dict((tag, dict(values)) for tag, values in self.compressionSavings.items()),
+                conformanceTime=self.conformanceTime,
+                metadataCompressTime=self.metadataCompressTime,
+                totalTime=self.totalTime
+            )
+
+
+# the zlib parameters tried by WOFFWriter in
+# compressionSearch mode as (level, memLevel, strategy).
+woffCompressionSearchParameters = [
+    (level, memLevel, strategy)
+    for strategy in (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, getattr(zlib, "Z_RLE", 3))
+    for memLevel in (8, 9)
+    for level in (5, 6, 7, 8, 9)
+]
+woffCompressionSearchWorkers = 4
+
+def _compressWithParameters(data, level, memLevel, strategy):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, memLevel, strategy)
+    return compressor.compress(data) + compressor.flush()
+
+# the rules used by isLikelyIncompressible. data no
+# longer than woffIncompressibleLength can never be made
+# smaller by zlib. for longer data, up to woffCompressionSampleCount
+# samples of woffCompressionSampleSize bytes, spread through the
+# data, are compressed with level 1. if the result is not smaller
+# than woffIncompressibleRatio times the sample length,
+# the data is considered incompressible.
+woffIncompressibleLength = 8
+woffCompressionSampleSize = 1024
+woffCompressionSampleCount = 4
+woffIncompressibleRatio = 0.97
+
+def isLikelyIncompressible(data):
+    """
+    Estimate whether compressing data with zlib would
+    fail to make it smaller without compressing all of it.
+
+    >>> isLikelyIncompressible("x" * 8)
+    True
+    >>> isLikelyIncompressible("x" * 5000)
+    False
+    >>> import random
+    >>> r = random.Random(1)
+    >>> isLikelyIncompressible("".join([chr(r.randint(0, 255)) for i in range(5000)]))
+    True
+    """
+    length = len(data)
+    if length <= woffIncompressibleLength:
+        return True
+    sampleLength = woffCompressionSampleSize * woffCompressionSampleCount
+    if length <= sampleLength:
+        sample = str(data)
+    else:
+        step = (length - woffCompressionSampleSize) // (woffCompressionSampleCount - 1)
+        sample = "".join([str(data[i * step:i * step + woffCompressionSampleSize]) for i in range(woffCompressionSampleCount)])
+    return len(zlib.compress(sample, 1)) >= len(sample) * woffIncompressibleRatio
+
+# shared padding for aligning data to four byte boundaries
+_paddingBytes = ("", "\0", "\0\0", "\0\0\0")
+
+# the default maximum size, in bytes, of a WOFFCompressionCache
+woffCompressionCacheSize = 64 * 1024 * 1024
+
+class WOFFCompressionCache(object):
+
+    """
+    A directory of compressed table data that is kept between
+    saves. Each entry holds the compressed data, the checksum
+    of the original data and a SHA-1 digest of both of these
+    and the data length. Entries that do not match their digest are treated
+    as missing and removed. The key is a hash of the tag, the
+    original data and the compression parameters, so an entry
+    is only found for identical input. Reading an entry takes
+    one file read. When the total size of the entries is larger
+    than maxSize, the entries that were used least recently
+    are removed. The number of cache hits and misses are stored
+    in the hits and misses attributes.
+
+    >>> directory = tempfile.mkdtemp()
+    >>> cache = WOFFCompressionCache(directory, maxSize=70)
+    >>> key = cache.makeKey("test", "abcd", (9,))
+    >>> cache.get(key) is None
+    True
+    >>> cache.set(key, 1234, "efgh")
+    >>> cache.get(key)
+    (1234, 'efgh')
+    >>> key == cache.makeKey("test", "abcd", (8,))
+    False
+    >>> cache.set(cache.makeKey("test", "ijkl", (9,)), 1234, "x" * 30)
+    >>> cache.get(key) is None
+    True
+    >>> cache.hits, cache.misses
+    (1, 2)
+    >>> damagedKey = cache.makeKey("test", "mnop", (9,))
+    >>> cache.set(damagedKey, 1234, "qrst")
+    >>> f = open(cache._path(damagedKey), "r+b")
+    >>> f.seek(-1, 2)
+    >>> f.write("x")
+    >>> f.close()
+    >>> cache.get(damagedKey) is None
+    True
+    >>> os.path.exists(cache._path(damagedKey))
+    False
+    >>> cache.set(damagedKey, 1234, "qrst")
+    >>> f = open(cache._path(damagedKey), "r+b")
+    >>> f.write("\\0\\0\\0\\0")
+    >>> f.close()
+    >>> cache.get(damagedKey) is None
+    True
+    >>> cache.clear()
+    >>> os.rmdir(directory)
+    """
+
+    _entryHeader = struct.Struct(">LL20s")
+    _entryDigestHeader = struct.Struct(">LL")
+    _entrySuffix = ".woffcache"
+
+    def __init__(self, directory, maxSize=woffCompressionCacheSize):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # find the existing entries, oldest first
+        self._entries = OrderedDict()
+        self.size = 0
+        entries = []
+        for fileName in os.listdir(directory):
+            if not fileName.endswith(self._entrySuffix):
+                continue
+            try:
+                info = os.stat(os.path.join(directory, fileName))
+            except OSError:
+                continue
+            entries.append((info.st_mtime, fileName[:-len(self._entrySuffix)], info.st_size))
+        for mtime, key, size in sorted(entries):
+            self._entries[key] = size
+            self.size += size
+
+    def makeKey(self, tag, data, parameters):
+        """
+        Make the key for data in the table with tag
+        compressed with parameters.
+        """
+        hasher = hashlib.sha1()
+        hasher.update(tag)
+        hasher.update(repr(parameters))
+        hasher.update(data)
+        return hasher.hexdigest()
+
+    def _digest(self, origChecksum, data):
+        hasher = hashlib.sha1()
+        hasher.update(self._entryDigestHeader.pack(origChecksum, len(data)))
+        hasher.update(data)
+        return hasher.digest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self._entrySuffix)
+
+    def get(self, key):
+        """
+        Get the (origChecksum, compressedData) for key.
+        If key is not in the cache, this returns None.
+        """
+        try:
+            f = open(self._path(key), "rb")
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        except (IOError, OSError):
+            data = None
+        # incomplete and damaged entries are removed
+        headerSize = self._entryHeader.size
+        damaged = False
+        if data is not None:
+            if len(data) >= headerSize:
+                origChecksum, compLength, digest = self._entryHeader.unpack_from(data)
+                damaged = len(data) != headerSize + compLength or self._digest(origChecksum, data[headerSize:]) != digest
+            else:
+                damaged = True
+            if damaged:
+                data = None
+                self._removeFile(key)
+        with self._lock:
+            if damaged:
+                self.size -= self._entries.pop(key, 0)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # move to the most recently used position
+            if key in self._entries:
+                self._entries[key] = self._entries.pop(key)
+        try:
+            os.utime(self._path(key), None)
+        except OSError:
+            pass
+        return origChecksum, data[headerSize:]
+
+    def set(self, key, origChecksum, data):
+        """
+        Store data and origChecksum for key. Data larger
+        than maxSize is never stored.
+        """
+        size = self._entryHeader.size + len(data)
+        if size > self.maxSize:
+            return
+        # write to a temporary file first so that
+        # readers never see a partial entry.
+        fileno, tempPath = tempfile.mkstemp(dir=self.directory)
+        try:
+            f = os.fdopen(fileno, "wb")
+            try:
+                f.write(self._entryHeader.pack(origChecksum, len(data), self._digest(origChecksum, data)))
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(tempPath, self._path(key))
+        except (IOError, OSError):
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+            return
+        with self._lock:
+            self.size -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self.size += size
+            while self.size > self.maxSize:
+                oldKey, oldSize = self._entries.popitem(last=False)
+                self.size -= oldSize
+                self._removeFile(oldKey)
+
+    def _removeFile(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        with self._lock:
+            for key in self._entries:
+                self._removeFile(key)
+            self._entries.clear()
+            self.size = 0
+
+def _writev(fileno, buffers, maxBuffers=1024):
+    """
+    Write all of the buffers to the file descriptor with
+    os.writev, handling partial writes and the limit on
+    the number of buffers per call.
+    """
+    buffers = list(buffers)
+    index = 0
+    while index < len(buffers):
+        written = os.writev(fileno, buffers[index:index + maxBuffers])
+        while index < len(buffers) and written >= len(buffers[index]):
+            written -= len(buffers[index])
+            index += 1
+        if written:
+            buffers[index] = memoryview(buffers[index])[written:]
+
+
+class _SourceTableData(object):
+
+    """
+    The location of compressed table data in a byte source.
+    """
+
+    __slots__ = ("source", "offset", "length")
+
+    def __init__(self, source, offset, length):
+        self.source = source
+        self.offset = offset
+        self.length = length
+
+
+class _SpilledTableData(object):
+
+    """
+    The location of compressed table data in a spill file.
+    """
+
+    __slots__ = ("offset", "length")
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+def _writeTestTables(file, **kwargs):
+    """
+    Write a fixed set of tables, metadata and private data
+    to file with a WOFFWriter created with kwargs. This is
+    used to check that the writer options that change how
+    the work is done do not change the output.
+
+    >>> serial = StringIO()
+    >>> _writeTestTables(serial)
+    >>> parallel = StringIO()
+    >>> _writeTestTables(parallel, workers=4)
+    >>> parallel.getvalue() == serial.getvalue()
+    True
+    >>> class WriteOnlyFile(object):
+    ...     def __init__(self):
+    ...         self.chunks = []
+    ...     def write(self, data):
+    ...         self.chunks.append(str(data))
+    >>> stream = WriteOnlyFile()
+    >>> _writeTestTables(stream, streaming=True)
+    >>> "".join(stream.chunks) == serial.getvalue()
+    True
+    >>> stream = WriteOnlyFile()
+    >>> _writeTestTables(stream, streaming=True, workers=4)
+    >>> "".join(stream.chunks) == serial.getvalue()
+    True
+    >>> spilled = StringIO()
+    >>> _writeTestTables(spilled, spill=True, workers=2)
+    >>> spilled.getvalue() == serial.getvalue()
+    True
+    """
+    compressed = "kern" * 100
+    tables = [
+        ("head", "\0" * 54, {}),
+        ("name", "name data " * 200, {}),
+        ("glyf", "".join([chr((i * 7) % 256) for i in range(5000)]), {}),
+        ("kern", zlib.compress(compressed), dict(origLength=len(compressed),
+            origChecksum=calcTableChecksum("kern", compressed), compLength=len(zlib.compress(compressed)))),
+        ("abcd", "x", {}),
+    ]
+    writer = WOFFWriter(file, len(tables), **kwargs)
+    for tag, data, entryValues in tables:
+        writer.setTable(tag, data, **entryValues)
+    writer.setMetadata("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<metadata version=\"1.0\"/>")
+    writer.setPrivateData("private data")
+    writer.close()
 
 
 # ---------
@@ -639,14 +2295,22 @@ woffDirectoryEntrySize = sstruct.calcsize(woffDirectoryEntryFormat)
 
 class WOFFDirectoryEntry(object):
 
+    """
+    A table directory entry. The attributes are stored
+    in slots rather than an instance dictionary to keep
+    the directories of many open fonts small.
+    """
+
+    __slots__ = ("tag", "offset", "compLength", "origLength", "origChecksum")
+
     def fromFile(self, file):
-        sstruct.unpack(woffDirectoryEntryFormat, file.read(woffDirectoryEntrySize), self)
+        self.fromString(file.read(woffDirectoryEntrySize))
 
     def fromString(self, str):
-        sstruct.unpack(woffDirectoryEntryFormat, str, self)
+        self.tag, self.offset, self.compLength, self.origLength, self.origChecksum = woffDirectoryEntryStruct.unpack(str)
 
     def toString(self):
-        return sstruct.pack(woffDirectoryEntryFormat, self)
+        return woffDirectoryEntryStruct.pack(self.tag, self.offset, self.compLength, self.origLength, self.origChecksum)
 
     def __repr__(self):
         if hasattr(self, "tag"):
@@ -661,6 +2325,138 @@ class WOFFDirectoryEntry(object):
 
 class WOFFLibError(Exception): pass
 
+def _sliceView(data, offset, length):
+    """
+    Return a view of length bytes starting at offset
+    in data without copying the bytes.
+
+    >>> str(_sliceView("abcdefgh", 2, 3))
+    'cde'
+    >>> _sliceView(memoryview("abcdefgh"), 2, 3).tobytes()
+    'cde'
+    """
+    # buffer does not accept memoryview objects
+    if isinstance(data, memoryview):
+        return data[offset:offset + length]
+    try:
+        return buffer(data, offset, length)
+    except NameError:
+        return memoryview(data)[offset:offset + length]
+
+def _sliceBytes(data, offset, length):
+    """
+    Return a copy of length bytes starting at offset in data.
+
+    >>> _sliceBytes(memoryview("abcdefgh"), 2, 3)
+    'cde'
+    >>> _sliceBytes(bytearray("abcdefgh"), 2, 3)
+    'cde'
+    """
+    view = _sliceView(data, offset, length)
+    if isinstance(view, memoryview):
+        return view.tobytes()
+    return str(view)
+
+def _getFileno(file):
+    """
+    Return the file descriptor for file or None
+    if it is not backed by a file descriptor.
+    """
+    try:
+        return file.fileno()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+def _copyFileRange(sourceFileno, offset, length, destinationFileno):
+    """
+    Copy length bytes at offset in the source file descriptor
+    to the current position of the destination file descriptor
+    inside the kernel, with os.copy_file_range or os.sendfile.
+    The source file position is not changed. This returns
+    the number of bytes copied, which is less than length
+    if neither call is available or supported by the files.
+    """
+    copied = 0
+    for name in ("copy_file_range", "sendfile"):
+        function = getattr(os, name, None)
+        if function is None:
+            continue
+        try:
+            while copied < length:
+                if name == "copy_file_range":
+                    count = function(sourceFileno, destinationFileno, length - copied, offset + copied)
+                else:
+                    count = function(destinationFileno, sourceFileno, offset + copied, length - copied)
+                if not count:
+                    break
+                copied += count
+        except OSError:
+            pass
+        if copied == length:
+            break
+    return copied
+
+def _pread(fileno, offset, length):
+    """
+    Read length bytes at offset from the file descriptor
+    without changing the file position. Fewer bytes are
+    returned only if the end of the file is reached.
+    """
+    data = os.pread(fileno, length, offset)
+    if len(data) == length or not data:
+        return data
+    chunks = [data]
+    read = len(data)
+    while read < length:
+        chunk = os.pread(fileno, length - read, offset + read)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        read += len(chunk)
+    return "".join(chunks)
+
+def decompressData(data, origLength):
+    """
+    Decompress data with zlib. No more than origLength
+    bytes will be produced. If the data would decompress
+    to more than origLength bytes, a WOFFLibError is raised
+    as soon as the limit is passed. zlib.error is raised
+    if the data is not a complete zlib stream.
+
+    >>> decompressData(zlib.compress("abcd"), 4)
+    'abcd'
+    >>> decompressData(zlib.compress("abcd" * 1000), 4)
+    Traceback (most recent call last):
+        ...
+    WOFFLibError: The decompressed data is longer than 4 bytes.
+    >>> decompressData(zlib.compress("abcd" * 1000)[:-8], 4000)
+    Traceback (most recent call last):
+        ...
+    error: The compressed data is incomplete.
+    """
+    decompressor = zlib.decompressobj()
+    # ask for one byte more than allowed to detect overruns
+    decompressed = decompressor.decompress(data, origLength + 1)
+    if len(decompressed) > origLength:
+        raise WOFFLibError("The decompressed data is longer than %d bytes." % origLength)
+    if not _isCompleteStream(decompressor, data, decompressed):
+        raise zlib.error("The compressed data is incomplete.")
+    return decompressed
+
+def _isCompleteStream(decompressor, data, decompressed):
+    eof = getattr(decompressor, "eof", None)
+    if eof is not None:
+        return eof
+    # zlib verifies the trailing Adler-32 checksum when the
+    # end of the stream is reached. if the bytes before any
+    # unused data are the checksum of the output, the stream
+    # was complete.
+    end = len(data) - len(decompressor.unused_data)
+    if end < 4:
+        return False
+    checksum = struct.unpack(">L", str(data[end - 4:end]))[0]
+    return checksum == zlib.adler32(decompressed) & 0xffffffff
+
 def calc4BytePaddedLength(length):
     return (length + 3) & ~3
 
@@ -673,31 +2469,31 @@ def calcTableChecksum(tag, data):
     return checksum
 
 def calcHeadCheckSumAdjustment(flavor, tables):
+    """
+    Calculate the head checkSumAdjustment from the flavor
+    and a dictionary of tag : dict(offset, length, checkSum)
+    entries. The checksum of the SFNT header and directory is
+    calculated directly from these values, so no data needs
+    to be built or checksummed.
+
+    >>> tables = {
+    ...     "head" : dict(offset=44, length=54, checkSum=123),
+    ...     "name" : dict(offset=100, length=100, checkSum=456),
+    ... }
+    >>> calcHeadCheckSumAdjustment("OTTO", tables)
+    2341635794
+    """
     numTables = len(tables)
-    # build the sfnt header
     searchRange, entrySelector, rangeShift = getSearchRange(numTables)
-    sfntDirectoryData = dict(
-        sfntVersion=flavor,
-        numTables=numTables,
-        searchRange=searchRange,
-        entrySelector=entrySelector,
-        rangeShift=rangeShift
-    )
-    # build the sfnt directory
-    directory = sstruct.pack(sfntDirectoryFormat, sfntDirectoryData)
-    for tag, entry in sorted(tables.items()):
-        entry = tables[tag]
-        sfntEntry = SFNTDirectoryEntry()
-        sfntEntry.tag = tag
-        sfntEntry.checkSum = entry["checkSum"]
-        sfntEntry.offset = entry["offset"]
-        sfntEntry.length = entry["length"]
-        directory += sfntEntry.toString()
-    # calculate the checkSumAdjustment
-    checkSums = [entry["checkSum"] for entry in tables.values()]
-    checkSums.append(calcChecksum(directory))
-    checkSumAdjustment = sum(checkSums)
-    checkSumAdjustment = (0xB1B0AFBA - checkSumAdjustment) & 0xffffffff
+    # the sfnt header
+    checkSum = struct.unpack(">L", flavor)[0]
+    checkSum += (numTables << 16) | searchRange
+    checkSum += (entrySelector << 16) | rangeShift
+    # the sfnt directory entries and the table data
+    for tag, entry in tables.items():
+        checkSum += struct.unpack(">L", tag)[0] + entry["offset"] + entry["length"]
+        checkSum += entry["checkSum"] * 2
+    checkSumAdjustment = (0xB1B0AFBA - checkSum) & 0xffffffff
     # done
     return checkSumAdjustment
 
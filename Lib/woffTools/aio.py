@@ -0,0 +1,213 @@
+"""
+An asyncio interface for reading and saving WOFF files.
+
+The objects and functions in this module do not block the
+event loop. File I/O and zlib work are run in an executor.
+Unless an executor is given, a shared thread pool with
+defaultMaxWorkers threads is used. The size of the pool
+bounds the number of WOFF jobs that can run at the same
+time, so one large font can not stall every other task.
+
+This package runs on Python 2, where the event loop is
+provided by trollius, the backport of asyncio. The
+futures are waited for with yield From(...):
+
+    from trollius import From
+
+    @asyncio.coroutine
+    def copyFont(path, outPath):
+        reader = yield From(AsyncWOFFReader.open(path))
+        glyf = yield From(reader.table("glyf"))
+        yield From(reader.close())
+        yield From(saveFontAsync(WOFFFont(path), outPath))
+
+All methods return futures rather than being coroutines,
+so they do not depend on the coroutine syntax.
+"""
+
+import os
+import shutil
+import tempfile
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+from woffTools import WOFFReader, WOFFWriter, WOFFFont
+
+defaultMaxWorkers = 4
+
+_defaultExecutor = None
+_defaultExecutorLock = threading.Lock()
+
+def getDefaultExecutor():
+    """
+    Return the shared executor used when no executor
+    is given. It is created the first time it is needed.
+    """
+    global _defaultExecutor
+    with _defaultExecutorLock:
+        if _defaultExecutor is None:
+            _defaultExecutor = ThreadPoolExecutor(max_workers=defaultMaxWorkers)
+        return _defaultExecutor
+
+def _runInExecutor(executor, loop, function, *args, **kwargs):
+    if executor is None:
+        executor = getDefaultExecutor()
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    if kwargs:
+        function = functools.partial(function, *args, **kwargs)
+        args = ()
+    return loop.run_in_executor(executor, function, *args)
+
+# ------
+# Reader
+# ------
+
+class AsyncWOFFReader(object):
+
+    """
+    This object wraps a WOFFReader. Use the open class
+    method to create one. The keyword arguments given to
+    open are passed to the WOFFReader. The WOFFReader is
+    available in the reader attribute.
+    """
+
+    def __init__(self, reader, executor=None, loop=None):
+        self.reader = reader
+        self.executor = executor
+        self.loop = loop
+
+    @classmethod
+    def open(cls, path, executor=None, loop=None, **kwargs):
+        """
+        Open the WOFF at path. This returns a future
+        with an AsyncWOFFReader as the result.
+        """
+        return _runInExecutor(executor, loop, cls._open, path, executor, loop, kwargs)
+
+    @classmethod
+    def _open(cls, path, executor, loop, kwargs):
+        file = open(path, "rb")
+        try:
+            reader = WOFFReader(file, **kwargs)
+        except:
+            file.close()
+            raise
+        return cls(reader, executor=executor, loop=loop)
+
+    def _run(self, function, *args, **kwargs):
+        return _runInExecutor(self.executor, self.loop, function, *args, **kwargs)
+
+    def keys(self):
+        return self.reader.keys()
+
+    def __contains__(self, tag):
+        return tag in self.reader
+
+    def table(self, tag):
+        """
+        Read and decompress a table. This returns a
+        future with the table data as the result.
+        """
+        return self._run(self.reader.__getitem__, tag)
+
+    def readTables(self, tags=None, workers=1):
+        """
+        Read and decompress several tables. This returns
+        a future with a dictionary of tag : data pairs
+        as the result. See WOFFReader.readTables.
+        """
+        return self._run(self.reader.readTables, tags, workers)
+
+    def compressedTable(self, tag):
+        """
+        This returns a future with the result of
+        WOFFReader.getCompressedTableData.
+        """
+        return self._run(self.reader.getCompressedTableData, tag)
+
+    def metadata(self):
+        """
+        This returns a future with the decompressed
+        metadata as the result.
+        """
+        return self._run(getattr, self.reader, "metadata")
+
+    def privateData(self):
+        """
+        This returns a future with the private
+        data as the result.
+        """
+        return self._run(getattr, self.reader, "privateData")
+
+    def close(self):
+        """
+        Close the reader and its file. This returns a future.
+        """
+        return self._run(self.reader.close)
+
+# ----
+# Save
+# ----
+
+def saveFontAsync(font, file, executor=None, loop=None, **kwargs):
+    """
+    Save a WOFFFont without blocking the event loop.
+    The keyword arguments are passed to WOFFFont.save.
+    This returns a future with the result of save as
+    its result.
+    """
+    return _runInExecutor(executor, loop, font.save, file, **kwargs)
+
+# ----
+# Test
+# ----
+
+def _testRoundTrip():
+    """
+    Write a small WOFF, read it and save it again with the
+    objects in this module, waiting for them in a coroutine
+    in the form shown in the module documentation.
+
+    >>> _testRoundTrip()
+    (['aaaa'], 'aaaa data aaaa data ', '<metadata version="1.0"/>', 'aaaa data aaaa data ')
+    """
+    directory = tempfile.mkdtemp()
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=2)
+    From = getattr(asyncio, "From", lambda future: future)
+    try:
+        path = os.path.join(directory, "test.woff")
+        outPath = os.path.join(directory, "out.woff")
+        f = open(path, "wb")
+        writer = WOFFWriter(f, 1)
+        writer.setTable("aaaa", "aaaa data " * 2)
+        writer.setMetadata('<metadata version="1.0"/>')
+        writer.close()
+        f.close()
+
+        @asyncio.coroutine
+        def roundTrip():
+            reader = yield From(AsyncWOFFReader.open(path, executor=executor, loop=loop, checkChecksums=0))
+            tags = reader.keys()
+            table = yield From(reader.table("aaaa"))
+            metadata = yield From(reader.metadata())
+            yield From(reader.close())
+            font = WOFFFont(path)
+            yield From(saveFontAsync(font, outPath, executor=executor, loop=loop))
+            font.reader.close()
+            raise asyncio.Return(tags, table, metadata)
+
+        tags, table, metadata = loop.run_until_complete(roundTrip())
+        reader = WOFFReader(open(outPath, "rb"), checkChecksums=0)
+        saved = reader["aaaa"]
+        reader.close()
+        return tags, table, metadata, saved
+    finally:
+        executor.shutdown()
+        loop.close()
+        shutil.rmtree(directory)
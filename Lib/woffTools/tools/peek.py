@@ -0,0 +1,110 @@
+"""
+A module for quickly reporting the header and table
+directory of many WOFF files. *peekFont* is the only
+public function.
+
+This can also be used as a command line tool that writes
+one JSON record per line (NDJSON) for each WOFF file.
+"""
+
+# import test
+
+importErrors = []
+try:
+    import fontTools
+except ImportError:
+    importErrors.append("fontTools")
+try:
+    import woffTools
+except ImportError:
+    importErrors.append("woffTools")
+
+if importErrors:
+    import sys
+    print "Could not import needed module(s):", ", ".join(importErrors)
+    sys.exit()
+
+# import
+
+import sys
+import json
+import optparse
+from woffTools import peek, WOFFLibError
+
+# ------
+# Record
+# ------
+
+def peekFont(path):
+    """
+    Create a JSON compatible record for the font at *path*.
+
+    **path** - The path to the WOFF file.
+
+    The record contains the path, the header values and
+    the table directory. If the file can not be read, the
+    record contains the path and an error message.
+    """
+    try:
+        header = peek(path)
+    except (IOError, OSError, WOFFLibError), error:
+        return dict(path=path, error=str(error))
+    record = dict(
+        path=path,
+        flavor=_decodeTag(header["flavor"]),
+        length=header["length"],
+        numTables=header["numTables"],
+        totalSFNTSize=header["totalSFNTSize"],
+        majorVersion=header["majorVersion"],
+        minorVersion=header["minorVersion"],
+        metaLength=header["metaLength"],
+        metaOrigLength=header["metaOrigLength"],
+        privLength=header["privLength"]
+    )
+    tables = []
+    for entry in header["tables"]:
+        tables.append(dict(
+            tag=_decodeTag(entry["tag"]),
+            offset=entry["offset"],
+            compLength=entry["compLength"],
+            origLength=entry["origLength"],
+            origChecksum=entry["origChecksum"]
+        ))
+    record["tables"] = tables
+    return record
+
+def _decodeTag(tag):
+    # tags in damaged files may not be valid UTF-8
+    return tag.decode("latin-1")
+
+# --------------------
+# Command Line Behvior
+# --------------------
+
+usage = "%prog [options] fontpath1 fontpath2"
+
+description = """This tool reads the header and table directory
+of one or more WOFF files and writes one JSON record per
+file to standard output. Only the header and directory
+are read from each file. If no paths are given, or the
+path is -, the paths are read from standard input, one
+per line.
+"""
+
+def main():
+    parser = optparse.OptionParser(usage=usage, description=description, version="%prog 0.1beta")
+    (options, args) = parser.parse_args()
+    if not args or args == ["-"]:
+        paths = (line.rstrip("\r\n") for line in sys.stdin)
+    else:
+        paths = args
+    for fontPath in paths:
+        if not fontPath:
+            continue
+        record = peekFont(fontPath)
+        sys.stdout.write(json.dumps(record, sort_keys=True))
+        sys.stdout.write("\n")
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
@@ -1116,8 +1116,10 @@ def _testTableDataDecompression(data, reporter):
             continue
         entryData = data[offset:offset+compLength]
         try:
-            decompressed = zlib.decompress(entryData)
+            decompressed = decompressData(entryData, origLength)
             reporter.logPass(message="The \"%s\" table data can be decompressed with zlib." % tag)
+        except DecompressionLimitError:
+            reporter.logError(message="The \"%s\" table data decompresses to more than the original length (%d)." % (tag, origLength))
         except zlib.error:
             reporter.logError(message="The \"%s\" table data can not be decompressed with zlib." % tag)
 
@@ -1199,9 +1201,13 @@ def _testMetadataDecompression(data, reporter):
     """
     if _shouldSkipMetadataTest(data, reporter):
         return
+    header = unpackHeader(data)
     compData = unpackMetadata(data, decompress=False, parse=False)
     try:
-        zlib.decompress(compData)
+        decompressData(compData, header["metaOrigLength"])
+    except DecompressionLimitError:
+        reporter.logError(message="The metadata decompresses to more than the original length (%d)." % header["metaOrigLength"])
+        return True
     except zlib.error:
         reporter.logError(message="The metadata can not be decompressed with zlib.")
         return True
@@ -1663,6 +1669,26 @@ def calcChecksum(tag, data):
     value = sumDataULongs(data)
     return value
 
+class DecompressionLimitError(zlib.error): pass
+
+def decompressData(data, origLength):
+    """
+    Decompress data without producing more than origLength
+    bytes. DecompressionLimitError is raised if the data
+    expands beyond origLength. zlib.error is raised if the
+    data is not a complete zlib stream.
+    """
+    decompressor = zlib.decompressobj()
+    decompressed = decompressor.decompress(data, origLength + 1)
+    if len(decompressed) > origLength:
+        raise DecompressionLimitError("The decompressed data is longer than %d bytes." % origLength)
+    # the stream is complete if the bytes before any unused
+    # data are the Adler-32 checksum of the decompressed data.
+    end = len(data) - len(decompressor.unused_data)
+    if end < 4 or struct.unpack(">L", data[end-4:end])[0] != zlib.adler32(decompressed) & 0xffffffff:
+        raise zlib.error("The compressed data is incomplete.")
+    return decompressed
+
 def calcHeadChecksum(data):
     header = unpackHeader(data)
     directory = unpackDirectory(data)
@@ -2343,7 +2369,7 @@ def unpackTableData(data):
             tableData = data[offset:offset+compLength]
         if compLength < origLength:
             try:
-                td = zlib.decompress(tableData)
+                td = decompressData(tableData, origLength)
                 tableData = td
             except zlib.error:
                 tableData = None
@@ -2354,7 +2380,7 @@ def unpackMetadata(data, decompress=True, parse=True):
     header = unpackHeader(data)
     data = data[header["metaOffset"]:header["metaOffset"]+header["metaLength"]]
     if decompress and data:
-        data = zlib.decompress(data)
+        data = decompressData(data, header["metaOrigLength"])
     if parse and data:
         data = ElementTree.fromstring(data)
     return data
@@ -31,5 +31,6 @@ setup(
         "woff-info",
         "woff-proof",
         "woff-css",
+        "woff-peek",
     ]
 )